@@ -60,6 +60,12 @@ class AdaptorDataModule(pl.LightningDataModule):
         return ceil(len(dataset) / self.batch_size)
 
     def _get_dataloader(self, split="train", shuffle=False):
+        # Worker-only options; DataLoader rejects them when num_workers == 0
+        worker_kwargs = (
+            {"persistent_workers": True, "prefetch_factor": 4}
+            if self.num_workers > 0
+            else dict()
+        )
         return DataLoader(
             self.datasets[split],
             pin_memory=True,
@@ -67,6 +73,7 @@ class AdaptorDataModule(pl.LightningDataModule):
             num_workers=self.num_workers,
             collate_fn=self.collate_fn,
             shuffle=shuffle,
+            **worker_kwargs,
         )
 
     def train_dataloader(self):
@@ -3,11 +3,11 @@ from typing import List, Union, Tuple, Dict, Optional
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 
 from pytorch_lightning import LightningModule
 
 from transformers import BertConfig
-from transformers.models.bert.modeling_bert import BertEncoder, BertPooler
 from transformers.modeling_outputs import BaseModelOutputWithPooling
 
 from transformers.modeling_utils import ModuleUtilsMixin
@@ -21,6 +21,11 @@ from torch.optim.lr_scheduler import CosineAnnealingWarmRestarts
 from tqdm import tqdm
 import sys
 
+try:
+    from apex.normalization import FusedLayerNorm as LayerNorm
+except ImportError:
+    LayerNorm = nn.LayerNorm
+
 
 def _get_activation_fn(activation: str):
     if activation == "relu":
@@ -30,6 +35,14 @@ def _get_activation_fn(activation: str):
     raise RuntimeError("activation should be relu/gelu, not {}".format(activation))
 
 
+@torch.jit.script
+def l2_normalize(x: torch.Tensor, eps: float = 1e-12) -> torch.Tensor:
+    # Scripted so the reduce, rsqrt and scale fuse into a single kernel.
+    # Sum of squares is accumulated in fp32, as x.norm does under autocast.
+    sq_norm = x.float().pow(2).sum(dim=-1, keepdim=True).clamp_min(eps)
+    return x * torch.rsqrt(sq_norm).to(x.dtype)
+
+
 class CLIPLossFromSimilarities(nn.Module):
     def __init__(self, image_weight=0.5):
         super().__init__()
@@ -80,13 +93,39 @@ class TransformerEncoderLayerWithCrossAttention(nn.Module):
         self.dropout = nn.Dropout(dropout)
         self.linear2 = nn.Linear(dim_feedforward, d_model)
 
-        self.norm1 = nn.LayerNorm(d_model)
-        self.norm2 = nn.LayerNorm(d_model)
+        self.norm1 = LayerNorm(d_model)
+        self.norm2 = LayerNorm(d_model)
         self.dropout1 = nn.Dropout(dropout)
         self.dropout2 = nn.Dropout(dropout)
 
         self.activation = _get_activation_fn(activation)
 
+    def _single_key_attn(self, query, key):
+        r"""Attention over a length-1 key/value sequence (e.g. pooled embeddings).
+
+        The softmax over a single key is identically 1, so the output is the
+        projected value broadcast to every query, with attention dropout applied
+        to those unit weights per head as nn.MultiheadAttention would.
+        """
+        embed_dim = self.attn.embed_dim
+        num_heads = self.attn.num_heads
+        in_proj_bias = self.attn.in_proj_bias
+        value = F.linear(
+            key,
+            self.attn.in_proj_weight[2 * embed_dim :],
+            None if in_proj_bias is None else in_proj_bias[2 * embed_dim :],
+        )
+        bz, tgt_len, _ = query.shape
+        if self.training and self.attn.dropout > 0:
+            attn_weights = F.dropout(
+                value.new_ones(bz, tgt_len, num_heads, 1), p=self.attn.dropout
+            )
+            value = attn_weights * value.view(bz, 1, num_heads, -1)
+            value = value.reshape(bz, tgt_len, embed_dim)
+        else:
+            value = value.expand(-1, tgt_len, -1)
+        return self.attn.out_proj(value)
+
     def forward(
         self,
         src,
@@ -107,12 +146,21 @@ class TransformerEncoderLayerWithCrossAttention(nn.Module):
         """
         if run_cross_attn:
             assert query is not None, "Must provide a query vector"
+        if (
+            src.size(1) == 1
+            and src_mask is None
+            and src_key_padding_mask is None
+            and self.attn._qkv_same_embed_dim
+        ):
+            src2 = self._single_key_attn(query if run_cross_attn else src, src)
+        elif run_cross_attn:
             src2 = self.attn(
                 query,
                 src,
                 src,
                 attn_mask=src_mask,
                 key_padding_mask=src_key_padding_mask,
+                need_weights=False,
             )[0]
         else:  # run self attention
             src2 = self.attn(
@@ -121,6 +169,7 @@ class TransformerEncoderLayerWithCrossAttention(nn.Module):
                 src,
                 attn_mask=src_mask,
                 key_padding_mask=src_key_padding_mask,
+                need_weights=False,
             )[0]
         src = src + self.dropout1(src2)
         src = self.norm1(src)
@@ -163,6 +212,21 @@ class AdaptorModule(nn.Module, ModuleUtilsMixin):
             self.encoder = TransformerEncoderLayerWithCrossAttention(
                 embed_dim, num_heads
             )
+        self.gradient_checkpointing = False
+
+    def gradient_checkpointing_enable(self):
+        self.gradient_checkpointing = True
+
+    def gradient_checkpointing_disable(self):
+        self.gradient_checkpointing = False
+
+    def _layer_forward(self, layer, src, query=None, run_cross_attn=False):
+        if self.gradient_checkpointing and self.training:
+            # Keep only layer-boundary activations, recompute the rest in backward
+            return checkpoint(
+                layer, src, query, None, None, run_cross_attn, use_reentrant=False
+            )
+        return layer(src=src, query=query, run_cross_attn=run_cross_attn)
 
     def forward(
         self,
@@ -188,11 +252,11 @@ class AdaptorModule(nn.Module, ModuleUtilsMixin):
             for layer in encoder_layers:
                 if isinstance(layer, Identity):
                     continue
-                image_embeds = layer(
-                    src=image_embeds, query=text_embeds, run_cross_attn=True
+                image_embeds = self._layer_forward(
+                    layer, src=image_embeds, query=text_embeds, run_cross_attn=True
                 )
-                text_embeds = layer(
-                    src=text_embeds, query=image_embeds, run_cross_attn=True
+                text_embeds = self._layer_forward(
+                    layer, src=text_embeds, query=image_embeds, run_cross_attn=True
                 )
 
             if text_embeds.dim() == 3:
@@ -206,7 +270,9 @@ class AdaptorModule(nn.Module, ModuleUtilsMixin):
             for layer in encoder_layers:
                 if isinstance(layer, Identity):
                     continue
-                image_embeds = layer(src=image_embeds, run_cross_attn=False)
+                image_embeds = self._layer_forward(
+                    layer, src=image_embeds, run_cross_attn=False
+                )
             return image_embeds
 
 
@@ -216,11 +282,13 @@ class Project(nn.Module):
         text_embed_dim: int,
         vision_embed_dim: int,
         projection_dim: int = 512,
+        normalize: bool = True,
     ):
         super(Project, self).__init__()
         self.text_embed_dim = text_embed_dim
         self.vision_embed_dim = vision_embed_dim
         self.projection_dim = projection_dim
+        self.normalize = normalize
         self.visual_projection = nn.Linear(vision_embed_dim, projection_dim, bias=False)
         self.text_projection = nn.Linear(text_embed_dim, projection_dim, bias=False)
 
@@ -230,15 +298,13 @@ class Project(nn.Module):
         text_embeds_: Optional[torch.Tensor] = None,
     ):
         image_embeds = self.visual_projection(image_embeds_)
-        image_embeds = image_embeds / image_embeds.norm(
-            dim=-1, keepdim=True
-        )  # normalized features
+        if self.normalize:
+            image_embeds = l2_normalize(image_embeds)  # normalized features
 
         if text_embeds_ is not None:
             text_embeds = self.text_projection(text_embeds_)
-            text_embeds = text_embeds / text_embeds.norm(
-                dim=-1, keepdim=True
-            )  # normalized features
+            if self.normalize:
+                text_embeds = l2_normalize(text_embeds)  # normalized features
             return image_embeds, text_embeds
 
         return image_embeds
@@ -257,6 +323,7 @@ class Adaptor(LightningModule):
         num_layers: int = 1,
         lr: float = 1e-4,
         image_weight: float = 0.75,
+        normalize_projection: bool = True,  # False skips the pre-adaptor L2 norm
     ):
         super(Adaptor, self).__init__()
 
@@ -264,6 +331,7 @@ class Adaptor(LightningModule):
             text_embed_dim=text_output_dim,
             vision_embed_dim=vision_output_dim,
             projection_dim=projection_dim,
+            normalize=normalize_projection,
         )
         self.adaptor_module = AdaptorModule(
             embed_dim=projection_dim, num_layers=num_layers
@@ -279,6 +347,12 @@ class Adaptor(LightningModule):
         self.lr = lr
         self.save_hyperparameters()
 
+    def gradient_checkpointing_enable(self):
+        self.adaptor_module.gradient_checkpointing_enable()
+
+    def gradient_checkpointing_disable(self):
+        self.adaptor_module.gradient_checkpointing_disable()
+
     def forward(
         self,
         image_embeds_raw: torch.FloatTensor,
@@ -299,28 +373,17 @@ class Adaptor(LightningModule):
                 image_embeds_full = image_embeds_full.unsqueeze(1)
             if len(text_embeds_full.shape) == 2:
                 text_embeds_full = text_embeds_full.unsqueeze(1)
-            image_embeds, text_embeds = (
-                image_embeds_full[:, 0, :],
-                text_embeds_full[:, 0, :],
-            )
+            # normalized features - only the [CLS] rows enter the logits
+            image_embeds = l2_normalize(image_embeds_full[:, 0, :])
+            text_embeds = l2_normalize(text_embeds_full[:, 0, :])
 
-            # normalized features - is this necessary for full embeddings?
-            image_embeds_full = image_embeds_full / image_embeds_full.norm(
-                dim=-1, keepdim=True
-            )
-            text_embeds_full = text_embeds_full / text_embeds_full.norm(
-                dim=-1, keepdim=True
-            )
-
-            image_embeds = image_embeds / image_embeds.norm(dim=-1, keepdim=True)
-            text_embeds = text_embeds / text_embeds.norm(dim=-1, keepdim=True)
-
-            # cosine similarity as logits
+            # cosine similarity as logits; scale the [B, D] operand rather than
+            # the [B, B] product, keeping logit_scale in the autograd graph
             logit_scale = self.logit_scale.exp()
-            logits_per_text = (
-                torch.matmul(text_embeds, image_embeds.t()) * logit_scale
+            logits_per_text = torch.matmul(
+                text_embeds * logit_scale, image_embeds.t()
             )  # [batch_size, batch_size]
-            logits_per_image = logits_per_text.T
+            logits_per_image = logits_per_text.t()
 
             loss = None
             if return_loss:
@@ -349,9 +412,7 @@ class Adaptor(LightningModule):
         else:  # text_embeds is none
             image_embeds_full = self.projection(image_embeds_raw)
             image_embeds_full = self.adaptor_module(image_embeds_full)
-            image_embeds_full = image_embeds_full / image_embeds_full.norm(
-                dim=-1, keepdim=True
-            )
+            image_embeds_full = l2_normalize(image_embeds_full)
 
             return image_embeds_full  # ignore return_dict and return_loss
 
@@ -75,8 +75,13 @@ class AdaptorFinetuner(LightningModule):
             store_path = (
                 "/vol/bitbucket/jq619/adaptor-thesis/saved_embeddings/dummy_text_embeds"
             )
-            self.dummy_text = torch.from_numpy(
-                torch.load(os.path.join(store_path, self.text_model_name + ".pt"))
+            # Buffer so it follows the module's device instead of a per-step copy
+            self.register_buffer(
+                "dummy_text",
+                torch.from_numpy(
+                    torch.load(os.path.join(store_path, self.text_model_name + ".pt"))
+                ),
+                persistent=False,
             )
         self.binary = binary
         self.multilabel = multilabel
@@ -160,7 +165,7 @@ class AdaptorFinetuner(LightningModule):
         feats = feats.view(feats.size(0), -1)
         if self.text_model_name is not None:
             batch_size = feats.size(0)
-            batch_text_dummy = self.dummy_text.repeat(batch_size, 1).to(feats.device)
+            batch_text_dummy = self.dummy_text.expand(batch_size, -1)
             _, _, feats, _ = self.adaptor(
                 feats, batch_text_dummy, return_loss=False, return_dict=False
             )
@@ -2,6 +2,7 @@ import torch
 
 from pytorch_lightning import Trainer, seed_everything
 from pytorch_lightning.loggers import CSVLogger, WandbLogger
+from pytorch_lightning.plugins import DDPPlugin
 import pytorch_lightning.callbacks as cb
 
 from dataset.dataset import MultimodalPretrainedEmbeddingsDataset
@@ -14,6 +15,9 @@ from utils.args import get_train_parser
 from math import ceil
 import wandb
 
+# Allow TF32 for any matmuls left in fp32 under mixed precision
+torch.set_float32_matmul_precision("high")
+
 
 def main(args):
     seed_everything(args.seed, workers=True)
@@ -41,7 +45,10 @@ def main(args):
         projection_dim=args.projection_dim,
         num_layers=args.num_layers,
         lr=args.lr,
+        normalize_projection=args.normalize_projection,
     )
+    if args.gradient_checkpointing:
+        model.gradient_checkpointing_enable()
 
     ### Load dataset
     device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -121,10 +128,17 @@ def main(args):
             "accelerator": "gpu",
             "devices": args.n_gpus,
             "num_nodes": 1,
-            "strategy": "ddp_find_unused_parameters_false",
+            # The adaptor graph is identical every step
+            "strategy": DDPPlugin(
+                find_unused_parameters=False,
+                static_graph=True,
+                gradient_as_bucket_view=True,
+            ),
+            "precision": 16,
         }
 
     trainer = Trainer(
+        benchmark=True,
         max_epochs=args.num_train_epochs,
         log_every_n_steps=args.log_every_n_steps,
         check_val_every_n_epoch=1,
@@ -38,6 +38,17 @@ def get_train_parser():
     parser.add_argument(
         "--projection_dim", type=int, default=768, help="dimension of projection head"
     )
+    parser.add_argument(
+        "--no_normalize_projection",
+        dest="normalize_projection",
+        action="store_false",
+        help="Skip L2-normalizing projected embeddings before the adaptor layers",
+    )
+    parser.add_argument(
+        "--gradient_checkpointing",
+        action="store_true",
+        help="Recompute adaptor layer activations in backward to save memory",
+    )
 
     parser.add_argument("--lr", type=float, default=1e-4)
     parser.add_argument("--weight_decay", type=float, default=1e-6)
@@ -1,9 +1,10 @@
 import torchvision.transforms as transforms
 import torchxrayvision as xrv
 import torch
+import torch.nn.functional as F
 from torch.utils.data import DataLoader, Dataset
 import numpy as np
-from transformers import ViTImageProcessor
+import cv2
 
 from typing import Union, Dict
 
@@ -25,7 +26,14 @@ def get_dataloader(
     shuffle=False,
     pin_memory=True,
     drop_last=False,
+    prefetch_factor=4,
 ):
+    # Worker-only options; DataLoader rejects them when num_workers == 0
+    worker_kwargs = (
+        {"persistent_workers": True, "prefetch_factor": prefetch_factor}
+        if num_workers > 0
+        else dict()
+    )
     return DataLoader(
         dataset,
         pin_memory=pin_memory,
@@ -34,6 +42,7 @@ def get_dataloader(
         collate_fn=collate_fn,
         num_workers=num_workers,
         drop_last=drop_last,
+        **worker_kwargs,
     )
 
 
@@ -98,11 +107,39 @@ class BatchedXRayCenterCrop(object):
         return self.crop_center(img)
 
 
+class BatchedXRayResizer(object):
+    """Batched xrv.datasets.XRayResizer: cv2.INTER_AREA over [B, C, H, W] at once"""
+
+    # cv2 INTER_AREA asserts cn <= 4 for non-integer scale factors
+    max_channels = 4
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def __call__(self, imgs):
+        b, c, h, w = imgs.shape
+        imgs = np.asarray(imgs, dtype=np.float32).reshape(b * c, h, w)
+        # cv2 resizes every channel of an [H, W, N] array in one call
+        out = [
+            cv2.resize(
+                np.ascontiguousarray(
+                    imgs[i : i + self.max_channels].transpose(1, 2, 0)
+                ),
+                (self.size, self.size),
+                interpolation=cv2.INTER_AREA,
+            ).reshape(self.size, self.size, -1)
+            for i in range(0, b * c, self.max_channels)
+        ]
+        out = np.concatenate(out, axis=-1).transpose(2, 0, 1)
+        return out.reshape(b, c, self.size, self.size)
+
+
+_XR_TRANSFORM = transforms.Compose([BatchedXRayCenterCrop(), BatchedXRayResizer(224)])
+
+
 def ae_image_processor(
     imgs: np.ndarray, return_dict=True
 ) -> Union[torch.Tensor, Dict[str, torch.Tensor]]:
-    imgs = xrv.datasets.normalize(imgs, 255)
-
     # Check that images are 2D arrays
     if len(imgs.shape) > 3:
         imgs = imgs[:, :, :, 0]
@@ -112,18 +149,41 @@ def ae_image_processor(
     # Add color channel
     imgs = imgs[:, None, :, :]
 
-    transform = transforms.Compose(
-        [xrv.datasets.XRayCenterCrop(), xrv.datasets.XRayResizer(224, engine="cv2")]
-    )
-    imgs = np.array([transform(img) for img in imgs])
+    # Normalize after crop+resize so the pass covers 224x224 rather than the
+    # full-resolution pixels; it is affine so it commutes with the area resize
+    imgs = xrv.datasets.normalize(_XR_TRANSFORM(imgs), 255)
     imgs = torch.from_numpy(imgs)
     if return_dict:
         return {"pixel_values": imgs}
     return imgs
 
 
-def timm_image_processor(imgs: np.ndarray) -> torch.Tensor:
-    return ViTImageProcessor()(imgs, return_tensors="pt", return_dict=True)
+def timm_image_processor(imgs: np.ndarray) -> Dict[str, torch.Tensor]:
+    """Batched approximation of ViTImageProcessor defaults (224 bilinear, mean=std=0.5).
+
+    Resizes in float with antialiasing rather than PIL's rounded uint8 resize,
+    so values differ slightly from ViTImageProcessor.
+    """
+    imgs = torch.from_numpy(np.ascontiguousarray(imgs)).float()
+    # Infer the channel axis as ViTImageProcessor does, channels-first first
+    if imgs.dim() == 3:  # grayscale [B, H, W]
+        imgs = imgs.unsqueeze(1)
+    elif imgs.size(1) in (1, 3):  # channels-first [B, C, H, W]
+        pass
+    elif imgs.size(3) in (1, 3):  # channels-last [B, H, W, C]
+        imgs = imgs.permute(0, 3, 1, 2)
+    else:
+        raise ValueError(
+            f"Expected 1 or 3 channels on axis 1 or 3, got {tuple(imgs.shape)}"
+        )
+    imgs = F.interpolate(
+        imgs, size=(224, 224), mode="bilinear", align_corners=False, antialias=True
+    )
+    imgs = (imgs / 255.0 - 0.5) / 0.5
+    if imgs.size(1) == 1:
+        # Resize/normalize one channel, then materialize 3 channels in one copy
+        imgs = imgs.expand(-1, 3, -1, -1).contiguous()
+    return {"pixel_values": imgs}
 
 
 def pickle_dataset(
@@ -161,7 +221,6 @@ def split_indices(n, num_shards, shuffle=False, seed=42):
 
 
 def torch2huggingface_dataset(torch_dataset, num_shards=1, shuffle=False, seed=42):
-
     shards = split_indices(len(torch_dataset), num_shards, shuffle=shuffle, seed=seed)
 
     def gen(shard_indices):
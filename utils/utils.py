@@ -33,41 +33,44 @@ def get_image_embeds_raw(
         device = vision_model.device
 
     if full:
+
+        def hub_forward(pixel_values):
+            output = vision_model(pixel_values, is_training=True)
+            local = output["x_norm_patchtokens"]
+            cls = output["x_norm_clstoken"].unsqueeze(1)
+            return torch.concat([cls, local], dim=1)
+
+        vision_forwards = {
+            "huggingface": lambda x: vision_model(
+                x,
+                output_attentions=False,
+                output_hidden_states=False,
+                return_dict=True,
+            ).last_hidden_state,
+            "timm": lambda x: vision_model(x),
+            "hub": hub_forward,
+            "ae": lambda x: torch.flatten(vision_model.decode(x), start_dim=2).permute(
+                (0, 2, 1)
+            ),
+        }
+        if vision_model_type not in vision_forwards:
+            raise ValueError(f"{vision_model_type} is not supported.")
+        # Resolve the model-type branch once rather than on every batch
+        vision_forward = vision_forwards[vision_model_type]
+
+        num_batches = len(dataloader)
         vision_model.eval()
         with torch.no_grad():
             for batch_idx, inputs in enumerate(tqdm(dataloader)):
                 for k, v in inputs.items():
                     if isinstance(v, torch.Tensor):
-                        inputs[k] = v.to(device=device)
+                        inputs[k] = v.to(device=device, non_blocking=True)
                 if batch_idx == 0:
                     assert (
                         inputs["pixel_values"].size(0) == batch_size
                     ), f"Expected batch size {batch_size}, got {inputs.pixel_values.size(0)}"
 
-                if vision_model_type == "huggingface":
-                    vision_outputs = vision_model(
-                        inputs.pixel_values,
-                        output_attentions=False,
-                        output_hidden_states=False,
-                        return_dict=True,
-                    )
-                    image_embeds_raw = vision_outputs.last_hidden_states
-                elif vision_model_type == "timm":
-                    image_embeds_raw = vision_model(inputs["pixel_values"])  # [:, 0, :]
-                elif vision_model_type == "hub":
-                    output = vision_model(inputs["pixel_values"], is_training=True)
-                    local = output["x_norm_patchtokens"]
-                    cls = output["x_norm_clstoken"].unsqueeze(1)
-                    image_embeds_raw = torch.concat([cls, local], dim=1)
-                elif vision_model_type == "ae":
-                    vision_outputs = vision_model.decode(inputs["pixel_values"])
-                    image_embeds_raw = torch.flatten(
-                        vision_outputs, start_dim=2
-                    ).permute(
-                        (0, 2, 1)
-                    )  # .mean(1)
-                else:
-                    raise ValueError(f"{vision_model_type} is not supported.")
+                image_embeds_raw = vision_forward(inputs["pixel_values"])
                 assert (
                     len(image_embeds_raw.size()) == 3
                 ), f"Expected 3D tensor, got {image_embeds_raw.size()}"
@@ -90,6 +93,24 @@ def get_image_embeds_raw(
 
             np.save(os.path.join(save_path, f"{model_name}_{split}.npy"), out)
     else:
+        vision_forwards = {
+            "huggingface": lambda x: vision_model(
+                x,
+                output_attentions=False,
+                output_hidden_states=False,
+                return_dict=True,
+            ).pooler_output,
+            "timm": lambda x: vision_model(x)[:, 0, :],
+            "hub": lambda x: vision_model(x),
+            "ae": lambda x: torch.flatten(vision_model.decode(x), start_dim=2)
+            .permute((0, 2, 1))
+            .mean(1),
+        }
+        if vision_model_type not in vision_forwards:
+            raise ValueError(f"{vision_model_type} is not supported.")
+        # Resolve the model-type branch once rather than on every batch
+        vision_forward = vision_forwards[vision_model_type]
+
         # Initialise empty npy
         num_batches = len(dataloader)
         out = np.zeros((len(dataloader.dataset), embedding_dim), dtype=np.float32)
@@ -99,33 +120,13 @@ def get_image_embeds_raw(
             for batch_idx, inputs in enumerate(tqdm(dataloader)):
                 for k, v in inputs.items():
                     if isinstance(v, torch.Tensor):
-                        inputs[k] = v.to(device=device)
+                        inputs[k] = v.to(device=device, non_blocking=True)
                 if batch_idx == 0:
                     assert (
                         inputs["pixel_values"].size(0) == batch_size
                     ), f"Expected batch size {batch_size}, got {inputs.pixel_values.size(0)}"
 
-                if vision_model_type == "huggingface":
-                    vision_outputs = vision_model(
-                        inputs.pixel_values,
-                        output_attentions=False,
-                        output_hidden_states=False,
-                        return_dict=True,
-                    )
-                    image_embeds_raw = vision_outputs.pooler_output
-                elif vision_model_type == "timm":
-                    image_embeds_raw = vision_model(inputs["pixel_values"])[:, 0, :]
-                elif vision_model_type == "hub":
-                    image_embeds_raw = vision_model(inputs["pixel_values"])
-                elif vision_model_type == "ae":
-                    vision_outputs = vision_model.decode(inputs["pixel_values"])
-                    image_embeds_raw = (
-                        torch.flatten(vision_outputs, start_dim=2)
-                        .permute((0, 2, 1))
-                        .mean(1)
-                    )
-                else:
-                    raise ValueError(f"{vision_model_type} is not supported.")
+                image_embeds_raw = vision_forward(inputs["pixel_values"])
                 assert (
                     len(image_embeds_raw.size()) == 2
                 ), f"Expected 2D tensor, got {image_embeds_raw.size()}"
@@ -168,7 +169,7 @@ def get_text_embeds_raw(
         for batch_idx, inputs in enumerate(tqdm(dataloader)):
             [inputs.pop(key, None) for key in removed_arguments]
             for k, v in inputs.items():
-                inputs[k] = v.to(device=device)
+                inputs[k] = v.to(device=device, non_blocking=True)
             text_embeds_raw = text_model(
                 **inputs,
                 output_attentions=False,